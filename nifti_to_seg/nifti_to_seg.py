@@ -1,13 +1,30 @@
 import argparse
+import copy
 import csv
+import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 import numpy as np
 import SimpleITK
 import pydicom
 import pydicom_seg
-from pathlib import Path
 from palettable.tableau import tableau
 
+# Optional GPU support for resampling
+try:
+    import cupy
+    import cupyx.scipy.ndimage
+except ImportError:
+    cupy = None
+
+# Optional faster JSON serialization of the segmentation metadata
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Set the log level
 logging.basicConfig(level=logging.WARN)
 
@@ -16,10 +33,86 @@ logger = logging.getLogger("NIfTI to SEG")
 
 # Get color palette
 colormap = tableau.get_map("Tableau_20")
+COLORS = tuple(colormap.colors)
 
 # Default CSV delimiter
 CSV_DELIMITER = ","
 
+# NumPy data types of the unsigned SimpleITK pixel types
+UNSIGNED_PIXEL_DTYPES = {
+    SimpleITK.sitkUInt8: np.uint8,
+    SimpleITK.sitkUInt16: np.uint16,
+    SimpleITK.sitkUInt32: np.uint32,
+    SimpleITK.sitkUInt64: np.uint64,
+}
+
+# Snomed Coding for Tissue (shared by all segments, must not be modified)
+TISSUE_CATEGORY_CODE = {
+    "CodeValue": "85756007",
+    "CodingSchemeDesignator": "SCT",
+    "CodeMeaning": "Tissue",
+}
+
+# Snomed Coding for Organ (shared by all segments, must not be modified)
+ORGAN_TYPE_CODE = {
+    "CodeValue": "113343008",
+    "CodingSchemeDesignator": "SCT",
+    "CodeMeaning": "Organ",
+}
+
+# Minimum number of voxels for which resampling is done on the GPU (if available)
+GPU_RESAMPLE_THRESHOLD = 10**7
+
+# Minimum number of DICOM files for which headers are read in parallel
+PARALLEL_READ_THRESHOLD = 16
+
+# DICOM tags of the source images that are used by pydicom-seg to build the SEG file
+# (references to the source images, slice mapping and imported patient/study hierarchy)
+SOURCE_IMAGE_TAGS = [
+    # Referenced images & slice mapping
+    "SOPClassUID",
+    "SOPInstanceUID",
+    "SeriesInstanceUID",
+    "StudyInstanceUID",
+    "FrameOfReferenceUID",
+    "PositionReferenceIndicator",
+    "ImagePositionPatient",
+    "ImageOrientationPatient",
+    "PixelSpacing",
+    "Rows",
+    "Columns",
+    "InstanceNumber",
+    # Patient module
+    "PatientName",
+    "PatientID",
+    "PatientBirthDate",
+    "PatientSex",
+    # General Study module
+    "StudyDate",
+    "StudyTime",
+    "ReferringPhysicianName",
+    "StudyID",
+    "AccessionNumber",
+    "StudyDescription",
+    "IssuerOfAccessionNumberSequence",
+    "ProcedureCodeSequence",
+    "ReasonForPerformedProcedureCodeSequence",
+    # General Equipment module
+    "Manufacturer",
+    "InstitutionName",
+    "InstitutionAddress",
+    "StationName",
+    "InstitutionalDepartmentName",
+    "ManufacturerModelName",
+    "DeviceSerialNumber",
+    "SoftwareVersions",
+    # Patient Study module
+    "AdmittingDiagnosesDescription",
+    "PatientAge",
+    "PatientSize",
+    "PatientWeight",
+]
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Convert NIfTI ROIs to the DICOM SEG format.")
@@ -109,6 +202,16 @@ def parse_args():
         default=False,
         nargs="?",
     )
+    # Read full DICOM headers
+    parser.add_argument(
+        "-f",
+        "--full_headers",
+        help="Read the full headers of the DICOM images instead of only the tags required to generate the DICOM-SEG file",
+        required=False,
+        const=True,
+        default=False,
+        nargs="?",
+    )
 
     args = parser.parse_args()
     logger.debug(f"parsed args : {vars(args)}")
@@ -116,13 +219,22 @@ def parse_args():
 
 
 def get_nifti_labels(sitk_image):
+    # Fractional (probability) maps have no labels, scanning them for unique values is extremely slow
+    if is_fractional(sitk_image):
+        raise ValueError("Labels can only be identified in segmentations with an integer pixel type!")
+
     print("Reading NIfTI file to identify ROIs...")
-    image_data = SimpleITK.GetArrayFromImage(sitk_image)
 
-    labels = np.trim_zeros(np.unique(image_data))
+    # Compute the labels directly on the ITK buffer instead of copying it to NumPy
+    label_filter = SimpleITK.LabelShapeStatisticsImageFilter()
+    label_filter.ComputePerimeterOff()
+    label_filter.Execute(sitk_image)
+    labels = list(label_filter.GetLabels())
+
     for label in labels:
-        logger.debug(f"found label n°{int(label)} in image")
+        logger.debug(f"found label n°{label} in image")
 
+    # Plain Python ints (not NumPy types) are used as labels
     return labels
 
 
@@ -135,7 +247,7 @@ def map_nifti_labels_to_names(labels):
         label_name = input(
             f"({i}/{len(labels)}) - Please insert a name for the region with assigned number {int(label)}: "
         )
-        labels_dict[label] = label_name
+        labels_dict[int(label)] = label_name
         i += 1
 
     print("Thank you, DICOM SEG file will be generated now...")
@@ -147,18 +259,21 @@ def parse_labelmap_file(labelmap_path, labels):
     labels_dict = {}
     line_count = 0
 
+    label_set = {int(label) for label in labels}
+
     with open(labelmap_path) as csv_file:
         csv_reader = csv.reader(csv_file, delimiter=CSV_DELIMITER)
         for row in csv_reader:
-            label_id = int(row[0].strip())
+            label_id = int(row[0])
             label_name = row[1].strip()
-            if label_id in labels:  # only include ids that are actually present in file
+            if label_id in label_set:  # only include ids that are actually present in file
                 labels_dict[label_id] = label_name
             line_count += 1
 
-        for label in labels:  # check that all labels present in image are included in labels_dict
-            if label not in labels_dict:
-                raise ValueError(f"Label with pixel value {label} is not present in the CSV file!")
+        # check that all labels present in image are included in labels_dict
+        missing_labels = label_set - labels_dict.keys()
+        if missing_labels:
+            raise ValueError(f"Label with pixel value {min(missing_labels)} is not present in the CSV file!")
 
         print(
             f"{len(labels)}/{len(labels)} labels correctly mapped with the provided CSV file, generating DICOM SEG file now..."
@@ -167,18 +282,73 @@ def parse_labelmap_file(labelmap_path, labels):
     return labels_dict
 
 
+def iter_dicom_paths_from_dir(dicom_dir):
+    for dir_path, _, file_names in os.walk(dicom_dir, followlinks=True):
+        for file_name in file_names:
+            yield os.path.join(dir_path, file_name)
+
+
 def get_dicom_paths_from_dir(dicom_dir):
-    files = Path(dicom_dir).glob("**/*")
-    paths = [str(f) for f in files if f.is_file()]
+    return list(iter_dicom_paths_from_dir(dicom_dir))
+
+
+def get_ordered_dicom_paths(dicom_dir):
+    reader = SimpleITK.ImageSeriesReader()
+
+    # GDCM does not look for series IDs in subfolders, so each folder is checked
+    series_ids = []
+    for dir_path, _, file_names in os.walk(dicom_dir, followlinks=True):
+        if file_names:
+            for series_id in reader.GetGDCMSeriesIDs(dir_path):
+                if series_id not in series_ids:
+                    series_ids.append(series_id)
+
+    # Fall back to all the files of the folder if GDCM could not identify a series
+    if not series_ids:
+        logger.warning(f"No DICOM series found by GDCM in {dicom_dir}, using all files of the folder")
+        return get_dicom_paths_from_dir(dicom_dir)
+
+    # GDCM only returns the DICOM files of the series, sorted by slice position
+    series_paths = {
+        series_id: list(reader.GetGDCMSeriesFileNames(str(dicom_dir), series_id, recursive=True))
+        for series_id in series_ids
+    }
+
+    # Use the largest series (e.g. not a localizer) if the folder contains several ones
+    series_id = max(series_ids, key=lambda series_id: len(series_paths[series_id]))
+    if len(series_ids) > 1:
+        logger.warning(
+            f"Found {len(series_ids)} DICOM series in {dicom_dir}, "
+            f"using series {series_id} with {len(series_paths[series_id])} files"
+        )
+
+    return series_paths[series_id]
+
+
+def read_dicom_header(dicom_path, full_headers=False):
+    if full_headers:
+        return pydicom.dcmread(dicom_path, stop_before_pixels=True)
+
+    return pydicom.dcmread(dicom_path, stop_before_pixels=True, specific_tags=SOURCE_IMAGE_TAGS)
+
+
+def read_dicom_headers(dicom_paths, full_headers=False):
+    read_header = partial(read_dicom_header, full_headers=full_headers)
+
+    # Small series are not worth the thread pool overhead
+    if len(dicom_paths) <= PARALLEL_READ_THRESHOLD:
+        return [read_header(path) for path in dicom_paths]
 
-    return paths
+    # Reading is mostly I/O bound, map() preserves the order of the paths
+    with ThreadPoolExecutor() as executor:
+        return list(executor.map(read_header, dicom_paths))
 
 
 def generate_metadata(roi_dict, series_description="Segmentation"):
     if roi_dict is not None:
         segment_attributes = [get_segments(roi_dict)]
     else:
-        segment_attributes = [[get_segment(1, "Probability Map", colormap.colors[0])]]
+        segment_attributes = [[get_segment(1, "Probability Map", COLORS[0])]]
 
     basic_info = {
         "ContentCreatorName": "NIfTI to SEG",
@@ -197,14 +367,31 @@ def generate_metadata(roi_dict, series_description="Segmentation"):
     return basic_info
 
 
-def get_segments(roi_dict):
-    segments = []
-    i = 0
-    for label, description in roi_dict.items():
-        segments.append(get_segment(label, description, colormap.colors[i % len(colormap.colors)]))
-        i += 1
+def _dumps_metadata(metadata):
+    if orjson is not None:
+        return orjson.dumps(metadata, option=orjson.OPT_SORT_KEYS).decode()
+    return json.dumps(metadata, sort_keys=True)
+
+
+@lru_cache(maxsize=32)
+def _build_template(metadata_json):
+    metadata = orjson.loads(metadata_json) if orjson is not None else json.loads(metadata_json)
+    return pydicom_seg.template.from_dcmqi_metainfo(metadata)
+
+
+def get_template(metadata):
+    # Avoid validating the same metadata again when converting several ROIs with the same labels
+    template = _build_template(_dumps_metadata(metadata))
+
+    # Do not share the cached dataset with the caller
+    return copy.deepcopy(template)
 
-    return segments
+
+def get_segments(roi_dict):
+    return [
+        get_segment(label, description, COLORS[i % len(COLORS)])
+        for i, (label, description) in enumerate(roi_dict.items())
+    ]
 
 
 def get_segment(label, description, color):
@@ -215,24 +402,20 @@ def get_segment(label, description, color):
         "SegmentLabel": description,
         "SegmentAlgorithmType": "AUTOMATIC",
         "SegmentAlgorithmName": "Automatic",
-        # Snomed Coding for Tissue
-        "SegmentedPropertyCategoryCodeSequence": {
-            "CodeValue": "85756007",
-            "CodingSchemeDesignator": "SCT",
-            "CodeMeaning": "Tissue",
-        },
-        # Snomed Coding for Organ
-        "SegmentedPropertyTypeCodeSequence": {
-            "CodeValue": "113343008",
-            "CodingSchemeDesignator": "SCT",
-            "CodeMeaning": "Organ",
-        },
+        "SegmentedPropertyCategoryCodeSequence": TISSUE_CATEGORY_CODE,
+        "SegmentedPropertyTypeCodeSequence": ORGAN_TYPE_CODE,
         # Color to display
         "recommendedDisplayRGBValue": color,
     }
 
 
 def match_orientation(sitk_img_ref, sitk_img_sec, verbose=True):
+    # Identical direction cosines always give the same orientation, no need for the filter
+    if np.allclose(sitk_img_ref.GetDirection(), sitk_img_sec.GetDirection(), rtol=0, atol=1e-6):
+        if verbose:
+            print("Reference image and second image have the same direction cosines")
+        return sitk_img_sec
+
     orientation_filter = SimpleITK.DICOMOrientImageFilter()
     orientation_ref = orientation_filter.GetOrientationFromDirectionCosines(sitk_img_ref.GetDirection())
     orientation_sec = orientation_filter.GetOrientationFromDirectionCosines(sitk_img_sec.GetDirection())
@@ -252,27 +435,139 @@ def match_orientation(sitk_img_ref, sitk_img_sec, verbose=True):
         return sitk_img_sec
 
 
-def match_size(sitk_img_ref, sitk_img_sec, verbose=True, interpolator=SimpleITK.sitkNearestNeighbor):
+def get_reoriented_size(sitk_img_ref, sitk_img_sec):
+    # Size of the second image once its axes are permuted to the orientation of the reference image
+    direction_ref = np.array(sitk_img_ref.GetDirection()).reshape(3, 3)
+    direction_sec = np.array(sitk_img_sec.GetDirection()).reshape(3, 3)
+    axes = np.argmax(np.abs(direction_ref.T @ direction_sec), axis=1)
+    return tuple(sitk_img_sec.GetSize()[axis] for axis in axes)
+
+
+def match_size(
+    sitk_img_ref,
+    sitk_img_sec,
+    verbose=True,
+    interpolator=SimpleITK.sitkNearestNeighbor,
+    output_pixel_type=None,
+    force=False,
+):
+    # With force=True, the second image is resampled on the reference grid even if both sizes are the same
     size_ref = sitk_img_ref.GetSize()
     size_sec = sitk_img_sec.GetSize()
     if verbose:
         print(f"Reference image has size '{size_ref}'")
         print(f"Second image has size    '{size_sec}'")
-    if not np.all(size_ref == size_sec):
+    if force or size_ref != size_sec:
         if verbose:
             print(f"Resampling second image: '{size_sec}' --> '{size_ref}'")
+        if interpolator == SimpleITK.sitkNearestNeighbor:
+            sitk_img_sec_resampled = _resample_nn_strided(sitk_img_sec, sitk_img_ref, output_pixel_type)
+            if sitk_img_sec_resampled is not None:
+                return sitk_img_sec_resampled
+            # Prefer CuPy > SimpleITK for large images
+            if sitk_img_sec.GetNumberOfPixels() > GPU_RESAMPLE_THRESHOLD and is_gpu_available():
+                try:
+                    return _resample_nn_cupy(sitk_img_sec, sitk_img_ref, output_pixel_type)
+                except (
+                    cupy.cuda.runtime.CUDARuntimeError,
+                    cupy.cuda.driver.CUDADriverError,
+                    cupy.cuda.memory.OutOfMemoryError,
+                ) as e:
+                    logger.warning(f"Resampling on the GPU failed ({e}), falling back to the CPU")
         resample = SimpleITK.ResampleImageFilter()
         resample.SetReferenceImage(sitk_img_ref)
         resample.SetInterpolator(interpolator)
+        if output_pixel_type is not None:
+            resample.SetOutputPixelType(output_pixel_type)
         sitk_img_sec_resampled = resample.Execute(sitk_img_sec)
         return sitk_img_sec_resampled
     else:
         return sitk_img_sec
 
 
-def get_dcm_as_sitk(path_to_dcm_dir):
+@lru_cache(maxsize=None)
+def is_gpu_available():
+    # Only initialize CUDA when the GPU is actually needed
+    return cupy is not None and cupy.cuda.is_available()
+
+
+def _get_index_transform(sitk_img_src, sitk_img_ref):
+    # Maps voxel indices of the reference image to (continuous) voxel indices of the source image
+    def index_to_physical(sitk_img):
+        direction = np.array(sitk_img.GetDirection()).reshape(3, 3)
+        return direction @ np.diag(sitk_img.GetSpacing()), np.array(sitk_img.GetOrigin())
+
+    matrix_ref, origin_ref = index_to_physical(sitk_img_ref)
+    matrix_src, origin_src = index_to_physical(sitk_img_src)
+    matrix_src_inv = np.linalg.inv(matrix_src)
+    matrix = matrix_src_inv @ matrix_ref
+    offset = matrix_src_inv @ (origin_ref - origin_src)
+
+    # SimpleITK indices are (x, y, z) whereas NumPy arrays are indexed (z, y, x)
+    return matrix[::-1, ::-1], offset[::-1]
+
+
+def _get_output_dtype(src, output_pixel_type):
+    if output_pixel_type is None:
+        return src.dtype
+    return UNSIGNED_PIXEL_DTYPES[output_pixel_type]
+
+
+def _resample_nn_strided(sitk_img_src, sitk_img_ref, output_pixel_type=None):
+    # Reference voxels map to source voxels with integer steps (crop, pad or downsampling),
+    # no interpolation is needed. Returns None if this is not the case.
+    matrix, offset = _get_index_transform(sitk_img_src, sitk_img_ref)
+    steps = np.round(np.diag(matrix))
+    start = np.round(offset)
+    if not (
+        np.allclose(matrix, np.diag(steps), rtol=0, atol=1e-6)
+        and np.all(steps >= 1)
+        and np.allclose(offset, start, rtol=0, atol=1e-3)
+    ):
+        return None
+
+    src = SimpleITK.GetArrayViewFromImage(sitk_img_src)
+    dst = np.zeros(sitk_img_ref.GetSize()[::-1], dtype=_get_output_dtype(src, output_pixel_type))
+    src_slices, dst_slices = [], []
+    for step, first, src_len, dst_len in zip(steps.astype(int), start.astype(int), src.shape, dst.shape):
+        # Range of reference indices whose source index (first + step * i) lies inside the source image
+        dst_start = min(max(0, -(first // step)), dst_len)
+        dst_stop = max(min(dst_len, (src_len - 1 - first) // step + 1), dst_start)
+        src_start = first + step * dst_start
+        src_slices.append(slice(src_start, src_start + step * (dst_stop - dst_start), step))
+        dst_slices.append(slice(dst_start, dst_stop))
+    dst[tuple(dst_slices)] = src[tuple(src_slices)]
+
+    sitk_img_resampled = SimpleITK.GetImageFromArray(dst)
+    sitk_img_resampled.CopyInformation(sitk_img_ref)
+    return sitk_img_resampled
+
+
+def _resample_nn_cupy(sitk_img_src, sitk_img_ref, output_pixel_type=None):
+    matrix, offset = _get_index_transform(sitk_img_src, sitk_img_ref)
+
+    src = cupy.asarray(SimpleITK.GetArrayViewFromImage(sitk_img_src))
+    dst = cupyx.scipy.ndimage.affine_transform(
+        src,
+        cupy.asarray(matrix),
+        offset=cupy.asarray(offset),
+        output_shape=sitk_img_ref.GetSize()[::-1],
+        output=_get_output_dtype(src, output_pixel_type),
+        order=0,
+        # Like SimpleITK, map coordinates up to half a voxel outside the source to its edge voxels
+        mode="grid-constant",
+        cval=0,
+    )
+
+    sitk_img_resampled = SimpleITK.GetImageFromArray(cupy.asnumpy(dst))
+    sitk_img_resampled.CopyInformation(sitk_img_ref)
+    return sitk_img_resampled
+
+
+def get_dcm_as_sitk(path_to_dcm_dir, dicom_names=None):
     reader = SimpleITK.ImageSeriesReader()
-    dicom_names = reader.GetGDCMSeriesFileNames(path_to_dcm_dir)
+    if dicom_names is None:
+        dicom_names = reader.GetGDCMSeriesFileNames(path_to_dcm_dir)
     reader.SetFileNames(dicom_names)
     image = reader.Execute()
     return image
@@ -290,40 +585,60 @@ def nifti_to_seg(
     skip_empty_slices=True,
     inplane_cropping=False,
     skip_missing_segment=False,
+    full_headers=False,
 ):
     # A segmentation image with integer data type
     # and a single component per voxel
     segmentation: SimpleITK.Image = sitk_image
 
     # Check if segmentation needs to be cast to unsigned type
-    if roi_dict is not None and segmentation.GetPixelID() not in [
-        SimpleITK.sitkUInt8,
-        SimpleITK.sitkUInt16,
-        SimpleITK.sitkUInt32,
-        SimpleITK.sitkUInt64,
-    ]:
-        segmentation = cast_to_unsigned(segmentation)
+    unsigned_pixel_type = None
+    if roi_dict is not None and segmentation.GetPixelID() not in UNSIGNED_PIXEL_DTYPES:
+        unsigned_pixel_type = get_unsigned_pixel_type(segmentation)
 
     # Paths to an imaging series related to the segmentation
-    dicom_series_paths = get_dicom_paths_from_dir(dicom_input)
-    source_images = [pydicom.dcmread(img, stop_before_pixels=True) for img in dicom_series_paths]
+    dicom_series_paths = get_ordered_dicom_paths(dicom_input)
+    source_images = read_dicom_headers(dicom_series_paths, full_headers)
 
     # Generate template JSON file based on the ROI dict
     metadata = generate_metadata(roi_dict, series_description)
-    template = pydicom_seg.template.from_dcmqi_metainfo(metadata)
+    template = get_template(metadata)
 
     # Ensure that segmentation image and dicom image have same orientation and size
     if match_orientation_flag or match_size_flag:
-        dicom_img = get_dcm_as_sitk(dicom_input)
+        dicom_img = get_dcm_as_sitk(dicom_input, dicom_series_paths)
         if match_orientation_flag:
-            segmentation = match_orientation(dicom_img, segmentation, verbose=True)
-        if match_size_flag:
+            size_sec = get_reoriented_size(dicom_img, segmentation)
+        else:
+            size_sec = segmentation.GetSize()
+
+        if match_size_flag and size_sec != dicom_img.GetSize():
+            # Resampling on the DICOM grid also matches the orientation and casts the segmentation in a single pass
             segmentation = match_size(
                 dicom_img,
                 segmentation,
                 interpolator=SimpleITK.sitkNearestNeighbor,
                 verbose=True,
+                output_pixel_type=unsigned_pixel_type,
+                force=True,
             )
+            # The resampled segmentation already has the unsigned pixel type
+            unsigned_pixel_type = None
+        else:
+            if match_orientation_flag:
+                segmentation = match_orientation(dicom_img, segmentation, verbose=True)
+            if match_size_flag:
+                segmentation = match_size(
+                    dicom_img,
+                    segmentation,
+                    interpolator=SimpleITK.sitkNearestNeighbor,
+                    verbose=True,
+                )
+        # The DICOM volume is not needed anymore, do not keep it in memory while writing the SEG file
+        del dicom_img
+
+    if unsigned_pixel_type is not None:
+        segmentation = SimpleITK.Cast(segmentation, unsigned_pixel_type)
 
     # Choose writer class (fractional or multiclass)
     writer_class = pydicom_seg.FractionalWriter if fractional else pydicom_seg.MultiClassWriter
@@ -342,12 +657,25 @@ def nifti_to_seg(
     # Write resulting DICOM SEG to the output
     writer = writer_class(**arguments)
     dcm = writer.write(segmentation, source_images)
-    dcm.save_as(seg_output)
+
+    # Drop this function's references before serializing the SEG file, this only frees the segmentation
+    # if it was cast or resampled (otherwise it is still the caller's image)
+    del writer, segmentation, source_images
+
+    # Always write a valid preamble & file meta header (pydicom 3 renamed write_like_original)
+    if int(pydicom.__version__.split(".")[0]) >= 3:
+        dcm.save_as(seg_output, enforce_file_format=True)
+    else:
+        dcm.save_as(seg_output, write_like_original=False)
 
     print(f"Successfully wrote output to {seg_output}")
 
 
 def cast_to_unsigned(segmentation):
+    return SimpleITK.Cast(segmentation, get_unsigned_pixel_type(segmentation))
+
+
+def get_unsigned_pixel_type(segmentation):
     original_pixel_type = segmentation.GetPixelID()
 
     if original_pixel_type == SimpleITK.sitkInt8:
@@ -361,9 +689,16 @@ def cast_to_unsigned(segmentation):
     else:
         raise ValueError("This segmentation pixel type is not supported!")
 
-    casted_segmentation = SimpleITK.Cast(segmentation, new_pixel_type)
+    # Use the smallest unsigned type that can hold all labels to reduce memory usage
+    min_max_filter = SimpleITK.MinimumMaximumImageFilter()
+    min_max_filter.Execute(segmentation)
+    if min_max_filter.GetMinimum() >= 0:
+        if min_max_filter.GetMaximum() <= np.iinfo(np.uint8).max:
+            new_pixel_type = SimpleITK.sitkUInt8
+        elif min_max_filter.GetMaximum() <= np.iinfo(np.uint16).max:
+            new_pixel_type = SimpleITK.sitkUInt16
 
-    return casted_segmentation
+    return new_pixel_type
 
 
 def is_fractional(sitk_image):
@@ -406,4 +741,5 @@ if __name__ == "__main__":
         args.skip_empty,
         args.inplane_cropping,
         args.skip_missing_segment,
+        args.full_headers,
     )
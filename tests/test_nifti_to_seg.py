@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+import SimpleITK
+
+from nifti_to_seg import nifti_to_seg
+
+
+class StubWriter:
+    # Captures the segmentation that would be encoded as DICOM-SEG
+    written = []
+
+    def __init__(self, **arguments):
+        pass
+
+    def write(self, segmentation, source_images):
+        StubWriter.written.append(segmentation)
+        return self
+
+    def save_as(self, *args, **kwargs):
+        pass
+
+
+def make_dicom_image():
+    sitk_img = SimpleITK.Image((20, 30, 10), SimpleITK.sitkInt16)
+    sitk_img.SetSpacing((1.0, 1.0, 2.0))
+    sitk_img.SetOrigin((-5.0, 3.0, 10.0))
+    return sitk_img
+
+
+def make_mask(dicom_img, geometry):
+    rng = np.random.default_rng(0)
+    mask = SimpleITK.GetImageFromArray(rng.integers(0, 4, dicom_img.GetSize()[::-1]).astype(np.int16))
+    mask.CopyInformation(dicom_img)
+
+    if geometry == "cropped":
+        mask = mask[2:15, 5:, 1:8]
+    elif geometry == "flipped":
+        mask = SimpleITK.Flip(mask, (True, False, True))
+    elif geometry == "permuted":
+        mask = SimpleITK.PermuteAxes(mask, (1, 0, 2))[3:, :, :]
+    elif geometry == "permuted_same_size":
+        # Axes swapped with respect to the series while the raw size equals the DICOM size
+        array = rng.integers(0, 4, dicom_img.GetSize()[::-1]).astype(np.int16)
+        mask = SimpleITK.GetImageFromArray(array)
+        mask.SetSpacing((1.0, 1.0, 2.0))
+        mask.SetOrigin(dicom_img.GetOrigin())
+        mask.SetDirection((0, 1, 0, 1, 0, 0, 0, 0, 1))
+
+    return mask
+
+
+def expected_segmentation(dicom_img, mask, match_orientation_flag, match_size_flag):
+    # Cast, reorient and resample in separate steps
+    segmentation = SimpleITK.Cast(mask, nifti_to_seg.get_unsigned_pixel_type(mask))
+    if match_orientation_flag:
+        orientation_filter = SimpleITK.DICOMOrientImageFilter()
+        orientation_filter.SetDesiredCoordinateOrientation(
+            orientation_filter.GetOrientationFromDirectionCosines(dicom_img.GetDirection())
+        )
+        segmentation = orientation_filter.Execute(segmentation)
+    if match_size_flag and segmentation.GetSize() != dicom_img.GetSize():
+        resample = SimpleITK.ResampleImageFilter()
+        resample.SetReferenceImage(dicom_img)
+        resample.SetInterpolator(SimpleITK.sitkNearestNeighbor)
+        segmentation = resample.Execute(segmentation)
+    return segmentation
+
+
+@pytest.fixture
+def stub_io(monkeypatch):
+    dicom_img = make_dicom_image()
+    StubWriter.written = []
+    monkeypatch.setattr(nifti_to_seg, "get_ordered_dicom_paths", lambda dicom_dir: [])
+    monkeypatch.setattr(nifti_to_seg, "read_dicom_headers", lambda dicom_paths, full_headers=False: [])
+    monkeypatch.setattr(nifti_to_seg, "get_dcm_as_sitk", lambda dicom_dir, dicom_names=None: dicom_img)
+    monkeypatch.setattr(nifti_to_seg.pydicom_seg, "MultiClassWriter", StubWriter)
+    return dicom_img
+
+
+@pytest.mark.parametrize("geometry", ["same", "cropped", "flipped", "permuted", "permuted_same_size"])
+@pytest.mark.parametrize("match_orientation_flag", [False, True])
+@pytest.mark.parametrize("match_size_flag", [False, True])
+def test_nifti_to_seg_matches_separate_steps(stub_io, geometry, match_orientation_flag, match_size_flag):
+    dicom_img = stub_io
+    mask = make_mask(dicom_img, geometry)
+    roi_dict = {1: "Liver", 2: "Kidney", 3: "Spleen"}
+
+    nifti_to_seg.nifti_to_seg(
+        mask,
+        "dicom",
+        "seg.dcm",
+        roi_dict,
+        match_orientation_flag=match_orientation_flag,
+        match_size_flag=match_size_flag,
+    )
+
+    (actual,) = StubWriter.written
+    expected = expected_segmentation(dicom_img, mask, match_orientation_flag, match_size_flag)
+    assert actual.GetPixelID() in nifti_to_seg.UNSIGNED_PIXEL_DTYPES
+    assert actual.GetPixelID() == expected.GetPixelID()
+    assert actual.GetSize() == expected.GetSize()
+    np.testing.assert_allclose(actual.GetOrigin(), expected.GetOrigin(), atol=1e-6)
+    np.testing.assert_allclose(actual.GetDirection(), expected.GetDirection(), atol=1e-6)
+    np.testing.assert_array_equal(SimpleITK.GetArrayViewFromImage(actual), SimpleITK.GetArrayViewFromImage(expected))
+
+
+def write_dicom_series(folder, num_slices, origin_z=0.0):
+    pydicom = pytest.importorskip("pydicom")
+    from pydicom.dataset import FileDataset, FileMetaDataset
+    from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+    folder.mkdir(parents=True)
+    study_uid, series_uid = generate_uid(), generate_uid()
+    for index in range(num_slices):
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = CTImageStorage
+        file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        dataset = FileDataset(None, {}, file_meta=file_meta, preamble=b"\0" * 128)
+        dataset.is_little_endian, dataset.is_implicit_VR = True, False
+        dataset.SOPClassUID = CTImageStorage
+        dataset.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+        dataset.StudyInstanceUID, dataset.SeriesInstanceUID = study_uid, series_uid
+        dataset.Modality = "CT"
+        dataset.ImagePositionPatient = [0.0, 0.0, origin_z + 2.0 * index]
+        dataset.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        dataset.PixelSpacing = [1.0, 1.0]
+        dataset.InstanceNumber = index + 1
+        dataset.Rows, dataset.Columns = 4, 4
+        dataset.SamplesPerPixel, dataset.PhotometricInterpretation = 1, "MONOCHROME2"
+        dataset.BitsAllocated, dataset.BitsStored, dataset.HighBit, dataset.PixelRepresentation = 16, 16, 15, 0
+        dataset.PixelData = np.zeros((4, 4), np.uint16).tobytes()
+        # Write slices in reverse order to check that paths are sorted by position
+        dataset.save_as(str(folder / f"{num_slices - index:03d}.dcm"))
+    return series_uid
+
+
+def test_get_ordered_dicom_paths_uses_largest_series(tmp_path):
+    write_dicom_series(tmp_path / "localizer", 2, origin_z=100.0)
+    series_uid = write_dicom_series(tmp_path / "ct" / "images", 40)
+    (tmp_path / "README.txt").write_text("not a DICOM file")
+
+    paths = nifti_to_seg.get_ordered_dicom_paths(str(tmp_path))
+
+    assert len(paths) == 40
+    assert all("images" in path for path in paths)
+    headers = nifti_to_seg.read_dicom_headers(paths)
+    assert {header.SeriesInstanceUID for header in headers} == {series_uid}
+    assert [float(header.ImagePositionPatient[2]) for header in headers] == [2.0 * i for i in range(40)]
@@ -0,0 +1,146 @@
+import types
+
+import numpy as np
+import pytest
+import SimpleITK
+
+from nifti_to_seg import nifti_to_seg
+
+
+def make_image(array, spacing, origin, direction=(1, 0, 0, 0, 1, 0, 0, 0, 1)):
+    sitk_img = SimpleITK.GetImageFromArray(array)
+    sitk_img.SetSpacing(spacing)
+    sitk_img.SetOrigin(origin)
+    sitk_img.SetDirection(direction)
+    return sitk_img
+
+
+def make_reference(size, spacing, origin, direction=(1, 0, 0, 0, 1, 0, 0, 0, 1)):
+    sitk_img = SimpleITK.Image(size, SimpleITK.sitkUInt8)
+    sitk_img.SetSpacing(spacing)
+    sitk_img.SetOrigin(origin)
+    sitk_img.SetDirection(direction)
+    return sitk_img
+
+
+def resample_sitk(sitk_img_src, sitk_img_ref, output_pixel_type=None):
+    resample = SimpleITK.ResampleImageFilter()
+    resample.SetReferenceImage(sitk_img_ref)
+    resample.SetInterpolator(SimpleITK.sitkNearestNeighbor)
+    if output_pixel_type is not None:
+        resample.SetOutputPixelType(output_pixel_type)
+    return resample.Execute(sitk_img_src)
+
+
+def assert_same_image(actual, expected):
+    assert actual.GetPixelID() == expected.GetPixelID()
+    assert actual.GetSize() == expected.GetSize()
+    np.testing.assert_allclose(actual.GetOrigin(), expected.GetOrigin())
+    np.testing.assert_allclose(actual.GetSpacing(), expected.GetSpacing())
+    np.testing.assert_allclose(actual.GetDirection(), expected.GetDirection())
+    np.testing.assert_array_equal(SimpleITK.GetArrayViewFromImage(actual), SimpleITK.GetArrayViewFromImage(expected))
+
+
+@pytest.fixture
+def source():
+    # Labels fill the whole volume, so they touch every border
+    array = np.random.default_rng(0).integers(1, 5, (12, 16, 20)).astype(np.int16)
+    return make_image(array, spacing=(1.5, 0.5, 2.0), origin=(10.0, -5.0, 3.0))
+
+
+# Reference grids that are oblique, permuted or shifted with respect to the source,
+# without any voxel center at exactly half a source voxel
+AFFINE_REFERENCES = {
+    "oblique": dict(size=(23, 19, 9), spacing=(1.1, 0.7, 2.3), origin=(8.2, -6.1, 1.3)),
+    "permuted": dict(
+        size=(11, 30, 24), spacing=(2.1, 0.6, 1.3), origin=(10.1, -5.2, 25.4), direction=(0, 0, 1, 1, 0, 0, 0, 1, 0)
+    ),
+    "flipped": dict(
+        size=(25, 18, 14), spacing=(1.2, 0.9, 1.7), origin=(38.3, 3.2, 3.3), direction=(-1, 0, 0, 0, -1, 0, 0, 0, 1)
+    ),
+}
+
+
+@pytest.fixture
+def fake_cupy(monkeypatch):
+    # Run the CuPy code path on the CPU with SciPy, which CuPy's ndimage module mirrors
+    scipy_ndimage = pytest.importorskip("scipy.ndimage")
+    fake = types.SimpleNamespace(asarray=np.asarray, asnumpy=np.asarray)
+    monkeypatch.setattr(nifti_to_seg, "cupy", fake)
+    monkeypatch.setattr(
+        nifti_to_seg, "cupyx", types.SimpleNamespace(scipy=types.SimpleNamespace(ndimage=scipy_ndimage)), raising=False
+    )
+
+
+@pytest.mark.parametrize("reference", AFFINE_REFERENCES.values(), ids=AFFINE_REFERENCES.keys())
+@pytest.mark.parametrize("output_pixel_type", [None, SimpleITK.sitkUInt8])
+def test_resample_nn_cupy_matches_sitk(fake_cupy, source, reference, output_pixel_type):
+    sitk_img_ref = make_reference(**reference)
+    expected = resample_sitk(source, sitk_img_ref, output_pixel_type)
+    assert_same_image(nifti_to_seg._resample_nn_cupy(source, sitk_img_ref, output_pixel_type), expected)
+
+
+@pytest.mark.skipif(not nifti_to_seg.is_gpu_available(), reason="CuPy with a usable CUDA device is not available")
+@pytest.mark.parametrize("reference", AFFINE_REFERENCES.values(), ids=AFFINE_REFERENCES.keys())
+def test_resample_nn_cupy_on_gpu_matches_sitk(source, reference):
+    sitk_img_ref = make_reference(**reference)
+    assert_same_image(nifti_to_seg._resample_nn_cupy(source, sitk_img_ref), resample_sitk(source, sitk_img_ref))
+
+
+# Stand-ins for the errors raised by cupy.cuda.runtime, cupy.cuda.driver and cupy.cuda.memory
+FAKE_CUDA_ERRORS = {
+    "runtime": type("CUDARuntimeError", (Exception,), {}),
+    "driver": type("CUDADriverError", (Exception,), {}),
+    "memory": type("OutOfMemoryError", (MemoryError,), {}),
+}
+
+
+@pytest.mark.parametrize("error_module", FAKE_CUDA_ERRORS.keys())
+def test_match_size_falls_back_to_cpu_on_gpu_errors(monkeypatch, source, error_module):
+    def fail(*args, **kwargs):
+        raise FAKE_CUDA_ERRORS[error_module]("GPU failure")
+
+    cuda = types.SimpleNamespace(
+        **{module: types.SimpleNamespace(**{error.__name__: error}) for module, error in FAKE_CUDA_ERRORS.items()}
+    )
+    monkeypatch.setattr(nifti_to_seg, "cupy", types.SimpleNamespace(cuda=cuda))
+    monkeypatch.setattr(nifti_to_seg, "is_gpu_available", lambda: True)
+    monkeypatch.setattr(nifti_to_seg, "GPU_RESAMPLE_THRESHOLD", 0)
+    monkeypatch.setattr(nifti_to_seg, "_resample_nn_cupy", fail)
+
+    sitk_img_ref = make_reference(**AFFINE_REFERENCES["oblique"])
+    actual = nifti_to_seg.match_size(sitk_img_ref, source, verbose=False)
+    assert_same_image(actual, resample_sitk(source, sitk_img_ref))
+
+
+# Reference grids aligned with the source grid (same direction, integer offset and integer step)
+STRIDED_REFERENCES = {
+    "crop": dict(size=(10, 8, 5), spacing=(1.5, 0.5, 2.0), origin=(13.0, -4.0, 7.0)),
+    "pad": dict(size=(30, 25, 20), spacing=(1.5, 0.5, 2.0), origin=(7.0, -6.0, -1.0)),
+    "negative_offset": dict(size=(18, 14, 10), spacing=(1.5, 0.5, 2.0), origin=(5.5, -7.5, -5.0)),
+    "disjoint": dict(size=(5, 5, 5), spacing=(1.5, 0.5, 2.0), origin=(100.0, 100.0, 101.0)),
+    "downsample": dict(size=(10, 8, 6), spacing=(3.0, 1.0, 4.0), origin=(10.0, -5.0, 3.0)),
+}
+
+
+@pytest.mark.parametrize("reference", STRIDED_REFERENCES.values(), ids=STRIDED_REFERENCES.keys())
+@pytest.mark.parametrize("output_pixel_type", [None, SimpleITK.sitkUInt8])
+def test_resample_nn_strided_matches_sitk(source, reference, output_pixel_type):
+    sitk_img_ref = make_reference(**reference)
+    expected = resample_sitk(source, sitk_img_ref, output_pixel_type)
+    assert_same_image(nifti_to_seg._resample_nn_strided(source, sitk_img_ref, output_pixel_type), expected)
+
+
+@pytest.mark.parametrize("reference", AFFINE_REFERENCES.values(), ids=AFFINE_REFERENCES.keys())
+def test_resample_nn_strided_rejects_unaligned_grids(source, reference):
+    assert nifti_to_seg._resample_nn_strided(source, make_reference(**reference)) is None
+
+
+@pytest.mark.parametrize(
+    "reference", {**STRIDED_REFERENCES, **AFFINE_REFERENCES}.values(), ids={**STRIDED_REFERENCES, **AFFINE_REFERENCES}
+)
+def test_match_size_matches_sitk(source, reference):
+    sitk_img_ref = make_reference(**reference)
+    expected = resample_sitk(source, sitk_img_ref, SimpleITK.sitkUInt8)
+    actual = nifti_to_seg.match_size(sitk_img_ref, source, verbose=False, output_pixel_type=SimpleITK.sitkUInt8)
+    assert_same_image(actual, expected)